@@ -1,9 +1,11 @@
 import pygame
-import random
-from math import sqrt
+from math import sqrt, ceil
 
 from typing import Union, List
 
+import sparse_tree
+from sparse_tree import SUBDIVISION, WORLD_SIZE
+
 Cell = Union[bool, List['Cell']]
 
 pygame.init()
@@ -16,21 +18,65 @@ BG_COLOR = (50, 50, 50)
 GRID_COLOR = (0, 0, 0)
 FULL_COLOR = (30, 144, 255)  # Dodger blue
 
-MAX_LEVEL = 3
-SUBDIVISION = 4
-DIMENSION = 2
-
-point_x = WIDTH // 2
-point_y = HEIGHT // 2
+point_x = WORLD_SIZE / 2
+point_y = WORLD_SIZE / 2
 
 POINT_SIZE = 5
-MOVE_SPEED = 10
+MOVE_SPEED = 10  # pixels per frame, scaled by the camera zoom
+PAN_SPEED = 15
+ZOOM_STEP = 1.1
+
+MIN_NODE_PIXELS = 1   # stop recursing once a node is smaller than this
+MIN_OUTLINE_PIXELS = 4  # skip grid lines on cells smaller than this
+
+# Zooming out far enough for the whole world to fit under one pixel keeps the cutoff reachable
+MIN_ZOOM, MAX_ZOOM = MIN_NODE_PIXELS / (2 * WORLD_SIZE), 1000.0
+
+
+class Camera:
+    """Maps world coordinates to screen pixels with pan and zoom."""
+
+    def __init__(self, offset, zoom: float):
+        self.offset = pygame.Vector2(offset)  # world position of the screen's top left corner
+        self.zoom = zoom  # pixels per world unit
+
+    def world_to_screen(self, point):
+        return (pygame.Vector2(point) - self.offset) * self.zoom
+
+    def screen_to_world(self, point):
+        return pygame.Vector2(point) / self.zoom + self.offset
+
+    def pan(self, dx, dy):
+        """Move the view by a number of screen pixels."""
+        self.offset += pygame.Vector2(dx, dy) / self.zoom
+
+    def zoom_at(self, screen_pos, factor: float):
+        """Zoom by factor keeping the world point under screen_pos fixed."""
+        anchor = self.screen_to_world(screen_pos)
+        self.zoom = max(MIN_ZOOM, min(MAX_ZOOM, self.zoom * factor))
+        self.offset = anchor - pygame.Vector2(screen_pos) / self.zoom
+
+
+def screen_rect(surface, x, y, w, h):
+    """Return the on-screen part of a float rect as a pygame.Rect, or None if it is off-screen.
+
+    The rect is clipped with a small margin so outlines of clipped rects stay off-screen
+    and huge zoom levels don't overflow pygame's integer rects.
+    """
+    view_w, view_h = surface.get_size()
+    if x >= view_w or y >= view_h or x + w <= 0 or y + h <= 0:
+        return None
+    left = max(x, -2)
+    top = max(y, -2)
+    right = min(x + w, view_w + 2)
+    bottom = min(y + h, view_h + 2)
+    return pygame.Rect(int(left), int(top),
+                       max(1, ceil(right - int(left))),
+                       max(1, ceil(bottom - int(top))))
+
 
-class Node:
-    def __init__(self, level: int):
-        self.level = level
-        self.children = None  # will hold subdivisions if any
-        self.generate()
+class Node(sparse_tree.Node):
+    """Tree node from sparse_tree.py with drawing and a fixed debug layout."""
 
     def debug(self):
         node3 = Node(2)
@@ -69,69 +115,57 @@ class Node:
         
             
 
-    def generate(self):
-        """Generate either a full/empty cell or subdivide per child."""
-        
-        # Always make children array
-        self.children = []
-        for _ in range(SUBDIVISION ** DIMENSION):
-            # Higher chance of subdividing at root level
-            if self.level < MAX_LEVEL:
-                if random.random() < 0.39:
-                    self.children.append(Node(self.level + 1))  # Subdivide further
-                else:
-                    self.children.append(False)
-            elif random.random() < 0.25:
-                # Make an empty leaf at max depth
-                
-                self.children.append(True)
-            else:
-                self.children.append(False)
-
-
-    def draw(self, surface, rect: pygame.Rect):
-        """Draw this node and any children."""
-        w = rect.width / SUBDIVISION
-        h = rect.height / SUBDIVISION
+    def draw(self, surface, camera: Camera, low, size: float):
+        """Draw the visible part of this node and any children.
+
+        low is the world position of the node's top left corner and size its side length.
+        """
+        top_left = camera.world_to_screen(low)
+        size_px = size * camera.zoom
+        rect = screen_rect(surface, top_left.x, top_left.y, size_px, size_px)
+        if rect is None:
+            return
+        if size_px < MIN_NODE_PIXELS:
+            # Whole subtree fits in a pixel, mark it only if something in it is full
+            if self.any_full():
+                surface.set_at(rect.topleft, FULL_COLOR)
+            return
+
+        child_size = size / SUBDIVISION
+        child_px = size_px / SUBDIVISION
         for x in range(SUBDIVISION):
             for y in range(SUBDIVISION):
                 cell = self.children[x + y * SUBDIVISION]
-                sub_rect = pygame.Rect(
-                    rect.x + x * w,
-                    rect.y + y * h,
-                    w,
-                    h
-                )
                 if isinstance(cell, Node):
-                    cell.draw(surface, sub_rect)
+                    cell.draw(surface, camera,
+                              pygame.Vector2(low.x + x * child_size, low.y + y * child_size),
+                              child_size)
+                    continue
+
+                sub_rect = screen_rect(surface,
+                                       top_left.x + x * child_px,
+                                       top_left.y + y * child_px,
+                                       child_px,
+                                       child_px)
+                if sub_rect is None:
+                    continue
+                # Empty cells are already covered by the background fill
+                if cell:
+                    pygame.draw.rect(surface, FULL_COLOR, sub_rect)
+                if child_px >= MIN_OUTLINE_PIXELS:
                     pygame.draw.rect(surface, GRID_COLOR, sub_rect, 1)
-                else:
-                    color = FULL_COLOR if cell else BG_COLOR
-                    pygame.draw.rect(surface, color, sub_rect)
-                
-                pygame.draw.rect(surface, GRID_COLOR, sub_rect, 1)
 
         # Draw grid outline
-        pygame.draw.rect(surface, GRID_COLOR, rect, 1)
-    
-    def get_cell(self, x, y):
-        x = int(x)
-        y = int(y)
-        
-        node = self.children[x + y * SUBDIVISION]
-        
-        return node
+        if size_px >= MIN_OUTLINE_PIXELS:
+            pygame.draw.rect(surface, GRID_COLOR, rect, 1)
 
-    def has_children(self):
-        return isinstance(self.children, list)
 
-
-def dda_iter(origin_px, ray_dir, step, ray_unit_step, low, high, grid: Node):
+def dda_iter(origin, ray_dir, step, ray_unit_step, low, high, grid: Node, camera: Camera):
     stack = []
     # Push initial state
     stack.append({
-        "old_origin": origin_px,
-        "origin": origin_px,
+        "old_origin": origin,
+        "origin": origin,
         "ray_dir": ray_dir,
         "step": step,
         "ray_unit_step": ray_unit_step,
@@ -160,7 +194,7 @@ def dda_iter(origin_px, ray_dir, step, ray_unit_step, low, high, grid: Node):
         resumed = state["resumed"]
 
         cell_jump = SUBDIVISION ** depth
-        cell_size = WIDTH / cell_jump
+        cell_size = WORLD_SIZE / cell_jump
 
         if not resumed:
             # grid lines check
@@ -199,7 +233,7 @@ def dda_iter(origin_px, ray_dir, step, ray_unit_step, low, high, grid: Node):
             ray_length = state["ray_length"]
             
             pygame.draw.circle(SCREEN, color,
-                origin + ray_dir * dist * cell_size,
+                camera.world_to_screen(origin + ray_dir * dist * cell_size),
                 size)
 
             # Step forward
@@ -269,7 +303,7 @@ def dda_iter(origin_px, ray_dir, step, ray_unit_step, low, high, grid: Node):
             elif cell:
                 color, size = (252, 63, 239), 3
             pygame.draw.circle(SCREEN, color,
-                origin + ray_dir * dist * cell_size,
+                camera.world_to_screen(origin + ray_dir * dist * cell_size),
                 size)
             if size == 3:
                 return True
@@ -298,52 +332,65 @@ def dda_iter(origin_px, ray_dir, step, ray_unit_step, low, high, grid: Node):
 clock = pygame.time.Clock()
 running = True
 
-top_grid_size = 4
-top_cell_w = WIDTH / top_grid_size
-top_cell_h = HEIGHT / top_grid_size
-
 grid = Node(1)
 grid.debug()
 b = 0
 
+# Start with the whole world fitted to the window
+camera = Camera((0, 0), min(WIDTH, HEIGHT) / WORLD_SIZE)
+
 while running:
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
+        elif event.type == pygame.MOUSEWHEEL:
+            camera.zoom_at(pygame.mouse.get_pos(), ZOOM_STEP ** event.y)
 
 
         # --- Movement ---
     keys = pygame.key.get_pressed()
+    move = MOVE_SPEED / camera.zoom
     if keys[pygame.K_w]:
-        point_y -= MOVE_SPEED
+        point_y -= move
     if keys[pygame.K_s]:
-        point_y += MOVE_SPEED
+        point_y += move
     if keys[pygame.K_a]:
-        point_x -= MOVE_SPEED
+        point_x -= move
     if keys[pygame.K_d]:
-        point_x += MOVE_SPEED
+        point_x += move
     if keys[pygame.K_t]:
         print((point_x, point_y))
-        print(pygame.mouse.get_pos())
+        print(camera.screen_to_world(pygame.mouse.get_pos()))
+
+        # --- Camera ---
+    if keys[pygame.K_LEFT]:
+        camera.pan(-PAN_SPEED, 0)
+    if keys[pygame.K_RIGHT]:
+        camera.pan(PAN_SPEED, 0)
+    if keys[pygame.K_UP]:
+        camera.pan(0, -PAN_SPEED)
+    if keys[pygame.K_DOWN]:
+        camera.pan(0, PAN_SPEED)
 
     # Keep point in bounds
-    point_x = max(0, min(WIDTH, point_x))
-    point_y = max(0, min(HEIGHT, point_y))
+    point_x = max(0, min(WORLD_SIZE, point_x))
+    point_y = max(0, min(WORLD_SIZE, point_y))
 
     SCREEN.fill(BG_COLOR)
     
-    rect = pygame.Rect(0,  0, WIDTH, HEIGHT)
-    grid.draw(SCREEN, rect)
+    grid.draw(SCREEN, camera, pygame.Vector2(0, 0), WORLD_SIZE)
 
     
     origin = pygame.Vector2(point_x, point_y)
-    #origin = pygame.Vector2(500, 500)
-    mouse = pygame.mouse.get_pos()
-    #mouse = pygame.Vector2(343, 412)
+    #origin = pygame.Vector2(2048, 2048)
+    mouse = camera.screen_to_world(pygame.mouse.get_pos())
+    #mouse = pygame.Vector2(1405, 1687)
     
-    pygame.draw.circle(SCREEN, (0, 255, 0), origin, POINT_SIZE)
-    pygame.draw.circle(SCREEN, (255, 0, 0), mouse, POINT_SIZE)
-    pygame.draw.line(SCREEN, (100, 100, 100), origin, mouse, 1)
+    origin_px = camera.world_to_screen(origin)
+    mouse_px = camera.world_to_screen(mouse)
+    pygame.draw.circle(SCREEN, (0, 255, 0), origin_px, POINT_SIZE)
+    pygame.draw.circle(SCREEN, (255, 0, 0), mouse_px, POINT_SIZE)
+    pygame.draw.line(SCREEN, (100, 100, 100), origin_px, mouse_px, 1)
     
     ray_dir = mouse - origin
     if ray_dir.length() != 0:
@@ -364,7 +411,7 @@ while running:
     low = pygame.math.Vector2(0,0)
     high = pygame.math.Vector2(SUBDIVISION, SUBDIVISION)
     
-    dda_iter(origin, ray_dir, step, ray_unit_step, low, high, grid)
+    dda_iter(origin, ray_dir, step, ray_unit_step, low, high, grid, camera)
 
     pygame.display.flip()
     clock.tick(30)
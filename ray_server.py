@@ -0,0 +1,424 @@
+"""Local ray query service for a shared sparse tree.
+
+Clients talk newline-delimited JSON over a Unix socket. Every request carries an "id" that is
+echoed back in its response, so a client can keep many requests in flight on one connection.
+
+    {"id": 1, "op": "ray", "origin": [x, y], "dir": [dx, dy], "max_dist": 100}
+    {"id": 2, "op": "segment", "start": [x, y], "end": [x, y]}
+    {"id": 3, "op": "set", "point": [x, y], "level": 3, "value": true}
+    {"id": 4, "op": "subscribe"}
+
+Ray and segment answers are {"id", "hit", "dist", "point"}. Edits are applied in arrival order
+relative to queries and published to every subscribed connection as {"op": "edit", ...}. The
+subscribe reply carries the current tree as nested lists in "tree", see Node.from_cells().
+
+Batches big enough for more than one chunk are split across a process pool, smaller ones run inline.
+Each worker holds a snapshot of the tree and replays the edits made since that snapshot, the pool is
+rebuilt from a fresh snapshot once the edit log grows.
+The service starts from an empty tree, fill it with set requests.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import stat
+from math import ceil, isfinite
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from sparse_tree import Node, dda_batch
+
+SOCKET_PATH = "/tmp/sparse_tree_dda.sock"
+BATCH_WINDOW = 0.002  # seconds a query may wait for others to join its batch
+MAX_BATCH = 256
+WORKERS = os.cpu_count() or 1
+MIN_CHUNK = 32  # smallest slice of a batch worth sending to its own worker
+REBUILD_EDITS = 256  # edits replayed by workers before the pool gets a fresh snapshot
+MAX_PENDING_REPLIES = 1024  # a client this far behind on reading is disconnected
+MAX_LINE = 64 * 1024  # longest request line in bytes
+
+# Per worker process state, set up by _init_worker
+_worker_grid = None
+_worker_applied = 0
+
+
+def _init_worker(grid: Node):
+    global _worker_grid, _worker_applied
+    _worker_grid = grid
+    _worker_applied = 0
+
+
+def _cast_chunk(edits, queries):
+    """Bring the worker's tree up to date with the edit log, then answer its share of a batch."""
+    global _worker_applied
+    for point, level, value in edits[_worker_applied:]:
+        _worker_grid.set_cell(point, level, value)
+    _worker_applied = len(edits)
+    return dda_batch(_worker_grid, queries)
+
+
+class Connection:
+    """Queues messages for one client and writes them only as fast as the client reads."""
+
+    def __init__(self, writer, max_pending: int = MAX_PENDING_REPLIES):
+        self.writer = writer
+        self.queue = asyncio.Queue(max_pending)
+        self.outstanding = 0  # requests handed to the batcher and not answered yet
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.sender = asyncio.create_task(self.send_loop())
+
+    async def send_loop(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                self.writer.write(data)
+                await self.writer.drain()
+                self.queue.task_done()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.writer.close()
+
+    def send(self, message: dict) -> bool:
+        """Queue a message, returns False once the connection is closed."""
+        if self.sender.done():
+            return False
+        try:
+            self.queue.put_nowait(json.dumps(message).encode() + b"\n")
+        except asyncio.QueueFull:
+            # Drop a client that fell behind instead of buffering for it without limit
+            self.close()
+            return False
+        return True
+
+    def start_request(self):
+        self.outstanding += 1
+        self.idle.clear()
+
+    def end_request(self):
+        self.outstanding -= 1
+        if self.outstanding == 0:
+            self.idle.set()
+
+    async def finish(self):
+        """Wait until every request is answered and written out, then close."""
+        flushed = asyncio.create_task(self._flush())
+        await asyncio.wait([flushed, self.sender], return_when=asyncio.FIRST_COMPLETED)
+        flushed.cancel()
+        self.close()
+
+    async def _flush(self):
+        await self.idle.wait()
+        await self.queue.join()
+
+    def close(self):
+        self.sender.cancel()
+
+
+class RayServer:
+    def __init__(self, grid: Node, batch_window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH,
+                 workers: int = WORKERS):
+        self.grid = grid
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.subscribers = set()
+        self.executor = None
+        self.edits = []  # edits applied to self.grid since the workers' snapshot
+
+    async def serve(self, path: str = SOCKET_PATH):
+        await _remove_stale_socket(path)
+        server = await asyncio.start_unix_server(self.handle_client, path=path, limit=MAX_LINE)
+        batcher = asyncio.create_task(self.run_batches())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.stop_pool()
+
+    def start_pool(self):
+        """Replace the worker pool with one built from a snapshot of the current tree."""
+        self.stop_pool()
+        # Spawned rather than forked workers don't inherit client sockets, which would keep them open
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker,
+                                            initargs=(copy.deepcopy(self.grid),))
+
+    def stop_pool(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.edits = []
+
+    async def handle_client(self, reader, writer):
+        conn = Connection(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Over the limit there is no telling where the next request starts, so stop reading
+                    self.reply(conn, {"id": None, "error": f"request longer than {MAX_LINE} bytes"})
+                    break
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    self.submit(request, conn)
+                except (ValueError, KeyError, TypeError) as e:
+                    request_id = request.get("id") if isinstance(request, dict) else None
+                    self.reply(conn, {"id": request_id, "error": str(e)})
+            # The client closed its write side or overran the limit, it still gets answers to what it sent
+            self.subscribers.discard(conn)
+            await conn.finish()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.subscribers.discard(conn)
+            conn.close()
+
+    def submit(self, request: dict, conn: Connection):
+        op = request["op"]
+        if op == "ray":
+            max_dist = _float(request.get("max_dist", float('inf')), "max_dist")
+            if max_dist != max_dist or max_dist < 0:
+                raise ValueError("max_dist must be a non-negative number")
+            query = ("ray", _point(request, "origin"), _point(request, "dir"), max_dist)
+        elif op == "segment":
+            query = ("segment", _point(request, "start"), _point(request, "end"))
+        elif op == "set":
+            level, value = request["level"], request["value"]
+            if not isinstance(level, int) or isinstance(level, bool):
+                raise ValueError("level must be an integer")
+            if not isinstance(value, bool):
+                raise ValueError("value must be true or false")
+            query = ("set", _point(request, "point"), level, value)
+        elif op == "subscribe":
+            # Edits still queued will reach the subscriber as deltas, so the snapshot and feed line up
+            self.subscribers.add(conn)
+            self.reply(conn, {"id": request.get("id"), "ok": True, "tree": self.grid.to_cells()})
+            return
+        else:
+            raise ValueError(f"unknown op {op!r}")
+        conn.start_request()
+        self.queue.put_nowait((request.get("id"), query, conn))
+
+    async def run_batches(self):
+        """Coalesce queued queries into batches, flushing early when an edit arrives."""
+        loop = asyncio.get_running_loop()
+        pending = None
+        while True:
+            batch = [pending or await self.queue.get()]
+            pending = None
+            deadline = loop.time() + self.batch_window
+            while batch[-1][1][0] != "set" and len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item[1][0] == "set":
+                    # Queries already in the batch must see the tree from before the edit
+                    pending = item
+                    break
+                batch.append(item)
+
+            if batch[-1][1][0] == "set":
+                self.apply_edit(*batch[-1])
+                # Let the senders flush before the next edit, a burst of edits would fill their queues
+                await asyncio.sleep(0)
+                continue
+
+            try:
+                results = await self.cast(batch)
+            except Exception as e:
+                # Keep the batcher alive, only this batch fails
+                if isinstance(e, BrokenProcessPool):
+                    self.stop_pool()
+                results = [e] * len(batch)
+            for (request_id, _, conn), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.answer(conn, {"id": request_id, "error": str(result)})
+                elif result is None:
+                    self.answer(conn, {"id": request_id, "hit": False, "dist": None, "point": None})
+                else:
+                    dist, point = result
+                    self.answer(conn, {"id": request_id, "hit": True, "dist": dist, "point": list(point)})
+
+    async def cast(self, batch):
+        """Split a batch into chunks, one per worker, and cast them in parallel."""
+        queries = [query for _, query, _ in batch]
+        chunk_count = max(1, min(self.workers, ceil(len(queries) / MIN_CHUNK)))
+        if chunk_count == 1:
+            # A single chunk gains nothing from the pool and would only pay for pickling
+            return dda_batch(self.grid, queries)
+
+        if self.executor is None:
+            self.start_pool()
+        chunk_size = ceil(len(queries) / chunk_count)
+        edits = tuple(self.edits)
+
+        loop = asyncio.get_running_loop()
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(self.executor, _cast_chunk, edits, queries[i:i + chunk_size])
+            for i in range(0, len(queries), chunk_size)))
+        return [result for chunk in chunks for result in chunk]
+
+    def apply_edit(self, request_id, query, conn: Connection):
+        _, point, level, value = query
+        try:
+            self.grid.set_cell(point, level, value)
+        except ValueError as e:
+            self.answer(conn, {"id": request_id, "error": str(e)})
+            return
+        if self.executor is not None:
+            self.edits.append((point, level, value))
+            if len(self.edits) > REBUILD_EDITS:
+                # The next multi-chunk batch starts a pool from a fresh snapshot
+                self.stop_pool()
+        self.answer(conn, {"id": request_id, "ok": True})
+        edit = {"op": "edit", "point": list(point), "level": level, "value": value}
+        for subscriber in list(self.subscribers):
+            self.reply(subscriber, edit)
+
+    def reply(self, conn: Connection, message: dict):
+        if not conn.send(message):
+            self.subscribers.discard(conn)
+
+    def answer(self, conn: Connection, message: dict):
+        """Reply to a request that went through the batcher."""
+        self.reply(conn, message)
+        conn.end_request()
+
+
+async def _remove_stale_socket(path: str):
+    """Remove a socket left behind by a dead server, refuse to touch anything else."""
+    if not os.path.lexists(path):
+        return
+    if not stat.S_ISSOCK(os.lstat(path).st_mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    try:
+        _, writer = await asyncio.open_unix_connection(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    writer.close()
+    raise RuntimeError(f"another server is already listening on {path}")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _float(value, key: str) -> float:
+    """Convert a JSON number to float, ints too large for a float raise ValueError."""
+    if not _is_number(value):
+        raise ValueError(f"{key} must be a number")
+    try:
+        return float(value)
+    except OverflowError:
+        raise ValueError(f"{key} is too large") from None
+
+
+def _point(request: dict, key: str):
+    """Return request[key] as an (x, y) tuple of finite floats or raise ValueError."""
+    value = request[key]
+    if not isinstance(value, list) or len(value) != 2:
+        raise ValueError(f"{key} must be a list of 2 finite numbers")
+    x, y = _float(value[0], key), _float(value[1], key)
+    if not isfinite(x) or not isfinite(y):
+        raise ValueError(f"{key} must be a list of 2 finite numbers")
+    return x, y
+
+
+class RayClient:
+    """Async client that pipelines requests over one connection."""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.next_id = 0
+        self.waiting = {}
+        self.edits = asyncio.Queue()  # edits published by the server after subscribe()
+        self.listener = None
+
+    async def connect(self, path: str = SOCKET_PATH):
+        # Replies can be much longer than requests, a subscribe reply carries the whole tree
+        self.reader, self.writer = await asyncio.open_unix_connection(path, limit=2 ** 24)
+        self.listener = asyncio.create_task(self.listen())
+
+    async def close(self):
+        self.listener.cancel()
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def listen(self):
+        try:
+            while line := await self.reader.readline():
+                message = json.loads(line)
+                if message.get("op") == "edit":
+                    self.edits.put_nowait(message)
+                    continue
+                future = self.waiting.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(ValueError(message["error"]))
+                else:
+                    future.set_result(message)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            # Nothing more will arrive, don't leave callers waiting forever
+            waiting, self.waiting = self.waiting, {}
+            for future in waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("connection to the ray server was closed"))
+
+    async def request(self, message: dict) -> dict:
+        if self.listener is None or self.listener.done():
+            raise ConnectionError("not connected to the ray server")
+        self.next_id += 1
+        message["id"] = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def ray(self, origin, direction, max_dist: float = float('inf')) -> dict:
+        message = {"op": "ray", "origin": list(origin), "dir": list(direction)}
+        if max_dist != float('inf'):
+            message["max_dist"] = max_dist
+        return await self.request(message)
+
+    async def segment(self, start, end) -> dict:
+        return await self.request({"op": "segment", "start": list(start), "end": list(end)})
+
+    async def set_cell(self, point, level: int, value: bool) -> dict:
+        return await self.request({"op": "set", "point": list(point), "level": level, "value": value})
+
+    async def subscribe(self) -> Node:
+        """Start receiving edits on self.edits and return the tree they apply to."""
+        reply = await self.request({"op": "subscribe"})
+        return Node.from_cells(reply["tree"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve ray queries on a sparse tree over a Unix socket")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW * 1000)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    server = RayServer(Node(1, generate=False), args.batch_window_ms / 1000, args.max_batch, args.workers)
+    asyncio.run(server.serve(args.socket))
@@ -0,0 +1,189 @@
+import random
+from math import hypot
+
+MAX_LEVEL = 3
+SUBDIVISION = 4
+DIMENSION = 2
+
+WORLD_SIZE = 4096.0  # side length of the root node in world units
+EPSILON = WORLD_SIZE * 1e-9  # nudge used to step across cell boundaries
+
+
+class Node:
+    """Headless sparse tree node, grid_iter.py adds drawing on top of it.
+
+    children holds SUBDIVISION ** DIMENSION entries, each either a Node or a bool (full/empty leaf).
+    """
+
+    def __init__(self, level: int, generate: bool = True):
+        self.level = level
+        self.children = [False] * (SUBDIVISION ** DIMENSION)
+        self._any_full = None  # cached by any_full(), reset by set_cell()
+        if generate:
+            self.generate()
+
+    def generate(self):
+        """Generate either a full/empty cell or subdivide per child."""
+        self.children = []
+        self._any_full = None
+        for _ in range(SUBDIVISION ** DIMENSION):
+            if self.level < MAX_LEVEL:
+                if random.random() < 0.39:
+                    self.children.append(type(self)(self.level + 1))  # Subdivide further
+                else:
+                    self.children.append(False)
+            elif random.random() < 0.25:
+                self.children.append(True)
+            else:
+                self.children.append(False)
+
+    def get_cell(self, x, y):
+        return self.children[int(x) + int(y) * SUBDIVISION]
+
+    def has_children(self):
+        return isinstance(self.children, list)
+
+    def any_full(self):
+        """Return True if any leaf in this subtree is full. Cached until the subtree is edited."""
+        if self._any_full is None:
+            self._any_full = any(cell.any_full() if isinstance(cell, Node) else cell
+                                 for cell in self.children)
+        return self._any_full
+
+    def to_cells(self):
+        """Return the subtree as nested lists of bools, the shape JSON can carry."""
+        return [cell.to_cells() if isinstance(cell, Node) else cell for cell in self.children]
+
+    @classmethod
+    def from_cells(cls, cells, level: int = 1):
+        """Build a tree from the nested lists returned by to_cells()."""
+        if not isinstance(cells, list) or len(cells) != SUBDIVISION ** DIMENSION or level > MAX_LEVEL:
+            raise ValueError("cells don't match the tree layout")
+        node = cls(level, generate=False)
+        node.children = [cls.from_cells(cell, level + 1) if isinstance(cell, list) else bool(cell)
+                         for cell in cells]
+        return node
+
+    def set_cell(self, point, level: int, value: bool):
+        """Set the cell at the given level that contains the world point. Call on the root.
+
+        Missing nodes on the way down are created empty, whatever was below the cell is replaced.
+        """
+        if not 0 <= point[0] < WORLD_SIZE or not 0 <= point[1] < WORLD_SIZE:
+            raise ValueError(f"point {tuple(point)} is outside the world")
+        if not self.level <= level <= MAX_LEVEL:
+            raise ValueError(f"level must be between {self.level} and {MAX_LEVEL}")
+
+        node = self
+        low_x, low_y, size = 0.0, 0.0, WORLD_SIZE
+        while True:
+            node._any_full = None
+            size /= SUBDIVISION
+            x = _cell_index(point[0] - low_x, size)
+            y = _cell_index(point[1] - low_y, size)
+            if node.level == level:
+                node.children[x + y * SUBDIVISION] = bool(value)
+                return
+            cell = node.children[x + y * SUBDIVISION]
+            if not isinstance(cell, Node):
+                # Split the leaf so its old value is kept around the edited cell
+                old = cell
+                cell = type(self)(node.level + 1, generate=False)
+                cell.children = [old] * (SUBDIVISION ** DIMENSION)
+                node.children[x + y * SUBDIVISION] = cell
+            node = cell
+            low_x += x * size
+            low_y += y * size
+
+
+def _cell_index(offset: float, size: float) -> int:
+    return max(0, min(SUBDIVISION - 1, int(offset / size)))
+
+
+def _find_leaf(grid: Node, x: float, y: float):
+    """Return (value, low_x, low_y, size) of the leaf containing the world point."""
+    node = grid
+    low_x, low_y, size = 0.0, 0.0, WORLD_SIZE
+    while True:
+        size /= SUBDIVISION
+        cx = _cell_index(x - low_x, size)
+        cy = _cell_index(y - low_y, size)
+        low_x += cx * size
+        low_y += cy * size
+        cell = node.get_cell(cx, cy)
+        if not isinstance(cell, Node):
+            return cell, low_x, low_y, size
+        node = cell
+
+
+def dda_cast(grid: Node, origin, direction, max_dist: float = float('inf')):
+    """Cast a ray through the tree without drawing anything.
+
+    Empty leaves are skipped whole, so the ray takes one step per empty cell of any size.
+    Returns (dist, (x, y)) of the first full cell hit, or None.
+    """
+    ox, oy = origin
+    dx, dy = direction
+    length = hypot(dx, dy)
+    if length == 0:
+        return None
+    dx /= length
+    dy /= length
+
+    # Clip the ray to the world square
+    t_enter, t_exit = 0.0, max_dist
+    for o, d in ((ox, dx), (oy, dy)):
+        if d == 0:
+            if o < 0 or o >= WORLD_SIZE:
+                return None
+            continue
+        t0 = -o / d
+        t1 = (WORLD_SIZE - o) / d
+        if t0 > t1:
+            t0, t1 = t1, t0
+        t_enter = max(t_enter, t0)
+        t_exit = min(t_exit, t1)
+    if t_enter > t_exit:
+        return None
+
+    # Rebase on the entry point so far away origins don't swallow the EPSILON steps
+    ex = min(max(ox + dx * t_enter, 0.0), WORLD_SIZE)
+    ey = min(max(oy + dy * t_enter, 0.0), WORLD_SIZE)
+    s_exit = t_exit - t_enter
+
+    s = 0.0
+    while s <= s_exit:
+        probe = s + EPSILON
+        full, low_x, low_y, size = _find_leaf(grid, ex + dx * probe, ey + dy * probe)
+        if full:
+            return t_enter + s, (ex + dx * s, ey + dy * s)
+
+        # Jump to the nearest boundary of this leaf, s stays within the world so + EPSILON always moves
+        sx = ((low_x + size if dx > 0 else low_x) - ex) / dx if dx != 0 else float('inf')
+        sy = ((low_y + size if dy > 0 else low_y) - ey) / dy if dy != 0 else float('inf')
+        s = max(min(sx, sy), s + EPSILON)
+    return None
+
+
+def dda_segment(grid: Node, start, end):
+    """Cast from start towards end, only reporting hits on the segment itself."""
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    return dda_cast(grid, start, (dx, dy), hypot(dx, dy))
+
+
+def dda_batch(grid: Node, queries):
+    """Answer a list of ("ray", origin, direction, max_dist) / ("segment", start, end) queries.
+
+    A query that raises gets its exception in place of the result, so one bad query can't fail the batch.
+    """
+    results = []
+    for query in queries:
+        try:
+            if query[0] == "ray":
+                results.append(dda_cast(grid, *query[1:]))
+            else:
+                results.append(dda_segment(grid, *query[1:]))
+        except (ValueError, TypeError, ArithmeticError) as e:
+            results.append(e)
+    return results
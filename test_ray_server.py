@@ -0,0 +1,178 @@
+import asyncio
+import json
+import random
+from math import hypot
+
+from sparse_tree import Node, WORLD_SIZE, _find_leaf, dda_cast, dda_segment
+from ray_server import RayServer, RayClient
+
+
+def sample_cast(grid, origin, direction, max_dist, step=0.01):
+    """Brute force reference, walk the ray in small steps and look up every point."""
+    length = hypot(*direction)
+    dx, dy = direction[0] / length, direction[1] / length
+    t = 0.0
+    while t <= max_dist:
+        x, y = origin[0] + dx * t, origin[1] + dy * t
+        if not (0 <= x < WORLD_SIZE and 0 <= y < WORLD_SIZE):
+            return None
+        if _find_leaf(grid, x, y)[0]:
+            return t
+        t += step
+    return None
+
+
+def test_dda_cast_matches_sampling():
+    random.seed(7)
+    grid = Node(1)
+    for _ in range(200):
+        grid.set_cell((random.uniform(0, WORLD_SIZE), random.uniform(0, WORLD_SIZE)), 3, True)
+    for _ in range(40):
+        origin = (random.uniform(0, WORLD_SIZE), random.uniform(0, WORLD_SIZE))
+        direction = (random.uniform(-1, 1), random.uniform(-1, 1))
+        hit = dda_cast(grid, origin, direction, 300)
+        sampled = sample_cast(grid, origin, direction, 300)
+        if sampled is None:
+            assert hit is None
+        else:
+            assert hit is not None
+            assert sampled - 0.01 <= hit[0] <= sampled
+
+
+def test_segment_stops_short_of_full_cell():
+    grid = Node(1, generate=False)
+    grid.set_cell((100, 100), 3, True)  # leaf covering [64, 128)
+    assert dda_segment(grid, (0, 100), (60, 100)) is None
+    assert dda_segment(grid, (0, 100), (70, 100)) == (64.0, (64.0, 100.0))
+
+
+def test_far_origin_terminates():
+    grid = Node(1, generate=False)
+    grid.set_cell((100, 2000), 3, True)
+    dist, point = dda_cast(grid, (1e15, 2000), (-1, 0))
+    assert point == (128.0, 2000.0)
+
+
+def run_server(tmp_path, check, grid=None, **kwargs):
+    """Run check(server, path) against a live server on a socket in tmp_path."""
+    path = str(tmp_path / "ray.sock")
+
+    async def main():
+        server = RayServer(grid or Node(1, generate=False), **kwargs)
+        task = asyncio.create_task(server.serve(path))
+        while not (tmp_path / "ray.sock").exists():
+            await asyncio.sleep(0.01)
+        try:
+            await asyncio.wait_for(check(server, path), 10)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+async def exchange(path, payload: bytes):
+    """Send raw request lines, half-close and return every reply until the server closes."""
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(payload)
+    writer.write_eof()
+    data = await reader.read()
+    writer.close()
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def lines(*requests):
+    return b"".join(json.dumps(request).encode() + b"\n" for request in requests)
+
+
+def test_edit_splits_batch(tmp_path):
+    async def check(server, path):
+        ray = {"op": "ray", "origin": [0, 100], "dir": [1, 0]}
+        replies = await exchange(path, lines(
+            {"id": 1, **ray},
+            {"id": 2, "op": "set", "point": [100, 100], "level": 3, "value": True},
+            {"id": 3, **ray}))
+        by_id = {reply["id"]: reply for reply in replies}
+        assert by_id[1]["hit"] is False
+        assert by_id[2] == {"id": 2, "ok": True}
+        assert by_id[3]["hit"] is True and by_id[3]["dist"] == 64.0
+
+    # The wide window makes all three arrive in the same batch
+    run_server(tmp_path, check, batch_window=0.2, workers=1)
+
+
+def test_validation_errors(tmp_path):
+    async def check(server, path):
+        replies = await exchange(path, lines(
+            {"id": 1, "op": "ray", "origin": [1, 2, 3], "dir": [1, 0]},
+            {"id": 2, "op": "ray", "origin": [float('nan'), 1], "dir": [1, 0]},
+            {"id": 3, "op": "ray", "origin": [10 ** 400, 1], "dir": [1, 0]},
+            {"id": 4, "op": "set", "point": [1, 1], "level": 3, "value": "false"},
+            {"id": 5, "op": "nope"},
+            {"id": 6, "op": "segment", "start": [1, 1], "end": [2, 2]}) + b"not json\n")
+        by_id = {reply["id"]: reply for reply in replies}
+        for request_id in (1, 2, 3, 4, 5, None):
+            assert "error" in by_id[request_id]
+        assert by_id[6]["hit"] is False
+
+    run_server(tmp_path, check, workers=1)
+
+
+def test_half_close_gets_all_answers(tmp_path):
+    async def check(server, path):
+        replies = await exchange(path, lines(
+            *({"id": i, "op": "ray", "origin": [1, 1], "dir": [1, 0]} for i in range(5))))
+        assert sorted(reply["id"] for reply in replies) == list(range(5))
+
+    run_server(tmp_path, check, workers=1)
+
+
+def test_oversize_line(tmp_path):
+    async def check(server, path):
+        replies = await exchange(path, lines({"id": 1, "op": "ray", "origin": [1, 1], "dir": [1, 0]})
+                                 + b"x" * 70000 + b"\n")
+        by_id = {reply["id"]: reply for reply in replies}
+        assert "error" in by_id[None]
+        assert by_id[1]["hit"] is False
+
+        # The server keeps serving other clients
+        replies = await exchange(path, lines({"id": 2, "op": "ray", "origin": [1, 1], "dir": [1, 0]}))
+        assert replies[0]["id"] == 2
+
+    run_server(tmp_path, check, workers=1)
+
+
+def test_subscribe_snapshot_and_edits(tmp_path):
+    async def check(server, path):
+        client = RayClient()
+        await client.connect(path)
+        await client.set_cell((5, 5), 3, True)
+        tree = await client.subscribe()
+        assert tree.to_cells() == server.grid.to_cells()
+
+        await client.set_cell((900, 5), 2, True)
+        edit = await client.edits.get()
+        tree.set_cell(edit["point"], edit["level"], edit["value"])
+        assert tree.to_cells() == server.grid.to_cells()
+        await client.close()
+
+    run_server(tmp_path, check, workers=1)
+
+
+def test_pool_matches_inline(tmp_path):
+    random.seed(3)
+    grid = Node(1)
+    rays = [((random.uniform(0, WORLD_SIZE), random.uniform(0, WORLD_SIZE)),
+             (random.uniform(-1, 1), random.uniform(-1, 1))) for _ in range(100)]
+
+    async def check(server, path):
+        client = RayClient()
+        await client.connect(path)
+        replies = await asyncio.gather(*(client.ray(origin, direction) for origin, direction in rays))
+        assert server.executor is not None
+        for reply, (origin, direction) in zip(replies, rays):
+            expected = dda_cast(grid, origin, direction)
+            assert reply["dist"] == (expected[0] if expected else None)
+        await client.close()
+
+    run_server(tmp_path, check, grid=grid, batch_window=0.2, workers=2)